@@ -1,32 +1,95 @@
+import atexit
 import bson.json_util
 import json
+import math
+import multiprocessing
+import os
+import struct
+import sys
 import threading
 import serial
 import time
-from pymongo import MongoClient
+from collections import OrderedDict
+from pymongo import MongoClient, ReadPreference, WriteConcern
+from pymongo.errors import PyMongoError
 from datetime import datetime
-from flask import Flask, jsonify, render_template_string, request
+from multiprocessing import resource_tracker, shared_memory
+from flask import Blueprint, Flask, current_app, jsonify, render_template_string, request
 from flask_cors import CORS
 
-app = Flask(__name__)
-CORS(app)
+bp = Blueprint('dashboard', __name__)
 
 MONGODB_URL = 'mongodb://localhost:27017/'
 DATABASE_NAME = 'arduino'
 COLLECTION_NAME = 'arduino'
 SETTINGS_COLLECTION = 'settings'
 
+# Ingest writes and API reads use separate clients so that request threads
+# never queue behind the serial reader for a pooled connection.
+MONGO_TIMEOUTS = {
+    'serverSelectionTimeoutMS': 3000,
+    'connectTimeoutMS': 3000,
+    'socketTimeoutMS': 10000,
+}
+INGEST_POOL = {'maxPoolSize': 4, 'minPoolSize': 1}
+READ_POOL = {'maxPoolSize': 50, 'minPoolSize': 0, 'maxIdleTimeMS': 60000}
+INGEST_WRITE_CONCERN = WriteConcern(w=1, j=False)
+MONGO_HEALTH_INTERVAL = 5
+
 ARDUINO_PORT = 'COM7'
 BAUD_RATE = 9600
 
-try:
-    client = MongoClient(MONGODB_URL)
-    db = client[DATABASE_NAME]
-    collection = db[COLLECTION_NAME]
-    settings_collection = db[SETTINGS_COLLECTION]
-except Exception as e:
-    print(f"MongoDB connection error: {e}")
-    exit(1)
+CACHE_MAX_ENTRIES = 20000
+CACHE_OPEN_TTL = 30
+HISTORY_FIELDS = ('temperatura', 'umidita', 'suono', 'luce', 'distanza')
+HISTORY_BUCKETS = (60, 300, 900, 3600, 86400)
+HISTORY_DEFAULT_RANGE = 3600
+HISTORY_MAX_BUCKETS = 1440
+# Buckets are treated as final only this long after they end, so in-flight
+# inserts don't get cached forever; final buckets are read from the primary
+HISTORY_CLOSE_GRACE = 60
+
+# 'thread' runs the serial reader inside the web process; 'process' moves it
+# to a single ingest owner (`python app.py --ingest`, or started by main())
+# and web workers serve latest readings from its shared memory segment.
+INGEST_MODE = 'thread'
+INGEST_RESTART_DELAY = 5
+SHARED_MEMORY_NAME = 'arduino_readings'
+SHARED_WINDOW_SIZE = 512
+SHARED_REATTACH_INTERVAL = 5
+SEQLOCK_MAX_RETRIES = 1000
+READING_FIELDS = ('temperatura', 'umidita', 'movimento', 'suono', 'luce', 'distanza')
+INT_READING_FIELDS = ('suono', 'luce')
+
+ingest_client = None
+read_client = None
+collection = None
+settings_collection = None
+read_collection = None
+current_collection = None
+api_settings_collection = None
+
+_storage_lock = threading.Lock()
+_services_lock = threading.Lock()
+_services_pid = None
+
+# Process ingest mode: the ingest owner creates the segment and its child
+# process is the only writer; web processes attach to it by name.
+shared_readings = None
+_ingest_mode = None
+_shared_owner = False
+_shared_checked_at = float('-inf')
+_shared_lock = threading.Lock()
+_shared_count_seen = 0
+
+# Updated by the background workers, read by /healthz and /readyz
+service_status = {
+    'mongo': False,
+    'settings_seeded': False,
+    'serial': False,
+    'last_mongo_check': None,
+    'last_reading': None,
+}
 
 default_settings = {
     'temperatura': True,
@@ -37,8 +100,464 @@ default_settings = {
     'distanza': True
 }
 
-if not settings_collection.find_one():
-    settings_collection.insert_one(default_settings)
+
+def init_storage():
+    """Create the MongoDB clients without connecting; safe to call repeatedly."""
+    global ingest_client, read_client, collection, settings_collection
+    global read_collection, current_collection, api_settings_collection
+
+    with _storage_lock:
+        if ingest_client is not None:
+            return
+        ingest_client = MongoClient(MONGODB_URL, appname='arduino-ingest', connect=False,
+                                    **INGEST_POOL, **MONGO_TIMEOUTS)
+        read_client = MongoClient(MONGODB_URL, appname='arduino-api', connect=False,
+                                  **READ_POOL, **MONGO_TIMEOUTS)
+
+        # Ingest side: primary acknowledgement without waiting on the journal
+        collection = ingest_client[DATABASE_NAME].get_collection(
+            COLLECTION_NAME, write_concern=INGEST_WRITE_CONCERN)
+        settings_collection = ingest_client[DATABASE_NAME][SETTINGS_COLLECTION]
+
+        # API side: the open end of history may be served by a secondary, while
+        # the latest reading, buckets cached for good and settings come from
+        # the primary when it is available
+        read_collection = read_client[DATABASE_NAME].get_collection(
+            COLLECTION_NAME, read_preference=ReadPreference.SECONDARY_PREFERRED)
+        current_collection = read_client[DATABASE_NAME].get_collection(
+            COLLECTION_NAME, read_preference=ReadPreference.PRIMARY_PREFERRED)
+        api_settings_collection = read_client[DATABASE_NAME][SETTINGS_COLLECTION]
+
+
+def check_mongo_health(client):
+    try:
+        client.admin.command('ping')
+        return True
+    except PyMongoError as e:
+        print(f"MongoDB health check failed: {e}")
+        return False
+
+
+def mongo_monitor():
+    """Ping MongoDB periodically; seed settings and indexes once it is reachable."""
+    while True:
+        healthy = check_mongo_health(ingest_client) and check_mongo_health(read_client)
+        service_status['mongo'] = healthy
+        service_status['last_mongo_check'] = time.time()
+
+        if healthy and not service_status['settings_seeded']:
+            try:
+                # Upsert so that several workers seeding at once leave one document
+                settings_collection.update_one({}, {'$setOnInsert': default_settings}, upsert=True)
+                collection.create_index('timestamp')
+                service_status['settings_seeded'] = True
+            except PyMongoError as e:
+                print(f"Error seeding default settings and indexes: {e}")
+
+        time.sleep(MONGO_HEALTH_INTERVAL)
+
+
+def start_services(start_ingest=True, ingest_mode=None):
+    """Start the MongoDB monitor and serial reader in parallel, once per process."""
+    global _services_pid, _ingest_mode
+
+    # Compare pids so a forked worker starts its own threads; checked once
+    # without the lock so the per-request hook stays cheap
+    if _services_pid == os.getpid():
+        return
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        init_storage()
+        _ingest_mode = ingest_mode or INGEST_MODE
+
+        threading.Thread(target=mongo_monitor, name='mongo-monitor', daemon=True).start()
+        # In process mode the serial port belongs to the ingest owner, never to
+        # a web process, so any number of workers can attach to its segment
+        if start_ingest and _ingest_mode == 'thread':
+            threading.Thread(target=arduino_reader, name='arduino-reader', daemon=True).start()
+        # Published last: other threads skip the lock only once storage is ready
+        _services_pid = os.getpid()
+
+
+def start_ingest_owner():
+    """Create the shared segment and supervise the ingest process writing to it."""
+    global shared_readings, _shared_owner
+
+    shared_readings = SharedReadings.create()
+    _shared_owner = True
+    atexit.register(shared_readings.unlink)
+    threading.Thread(target=ingest_supervisor, args=(shared_readings,),
+                     name='ingest-supervisor', daemon=True).start()
+
+
+def ingest_supervisor(readings):
+    # spawn gives the child fresh MongoClients instead of forked copies
+    context = multiprocessing.get_context('spawn')
+    while True:
+        process = context.Process(target=ingest_process_main, args=(readings.name,),
+                                  name='arduino-ingest', daemon=True)
+        process.start()
+        process.join()
+        print(f"Ingest process exited with code {process.exitcode}, restarting...")
+        readings.set_serial(False)
+        time.sleep(INGEST_RESTART_DELAY)
+
+
+def ingest_process_main(shm_name):
+    global shared_readings
+
+    # Spawned children share the owner's resource tracker, so stay registered
+    shared_readings = SharedReadings.attach(shm_name, track=True)
+    init_storage()
+    try:
+        arduino_reader()
+    finally:
+        shared_readings.close()
+
+
+def ingest_main():
+    start_ingest_owner()
+    print(f"Ingest owner publishing to shared memory '{SHARED_MEMORY_NAME}'")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Ingest owner shutting down...")
+
+
+class QueryCache:
+    """LRU cache for API query results.
+
+    Closed history buckets are stored one entry per bucket and never expire.
+    Entries marked open (the trailing bucket, the latest reading) are dropped
+    whenever a new reading is stored, and after CACHE_OPEN_TTL as a fallback.
+    Concurrent misses on the same key share the result of a single query.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, open_ttl=CACHE_OPEN_TTL):
+        self.max_entries = max_entries
+        self.open_ttl = open_ttl
+        self._entries = OrderedDict()
+        self._open_keys = set()
+        self._inflight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry['expires'] is not None and entry['expires'] < time.monotonic():
+            del self._entries[key]
+            self._open_keys.discard(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, is_open):
+        expires = time.monotonic() + self.open_ttl if is_open else None
+        self._entries[key] = {'value': value, 'open': is_open, 'expires': expires}
+        self._entries.move_to_end(key)
+        if is_open:
+            self._open_keys.add(key)
+        else:
+            self._open_keys.discard(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._open_keys.discard(evicted)
+            self._stats['evictions'] += 1
+
+    def get_or_compute(self, key, compute, is_open=False, store=True):
+        """Return the cached value for key, or compute it once for all callers.
+
+        With store=False the result is only shared with concurrent callers.
+        """
+        with self._lock:
+            if store:
+                entry = self._lookup(key)
+                if entry is not None:
+                    self._stats['hits'] += 1
+                    return entry['value']
+                self._stats['misses'] += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'done': threading.Event(), 'value': None, 'error': None}
+                self._inflight[key] = flight
+            else:
+                self._stats['coalesced'] += 1
+            generation = self._generation
+
+        if not leader:
+            # Take the leader's result even if it was too stale to store
+            flight['done'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['value']
+
+        try:
+            flight['value'] = compute()
+            if store:
+                with self._lock:
+                    # Don't store an open result that predates a new reading
+                    if not (is_open and generation != self._generation):
+                        self._store(key, flight['value'], is_open)
+            return flight['value']
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight['done'].set()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._lookup(key)
+                if entry is not None:
+                    found[key] = entry['value']
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        with self._lock:
+            for key, value in items.items():
+                self._store(key, value, False)
+
+    def invalidate_open(self):
+        with self._lock:
+            self._generation += 1
+            for key in self._open_keys:
+                del self._entries[key]
+            self._stats['invalidations'] += len(self._open_keys)
+            self._open_keys.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+query_cache = QueryCache()
+
+
+def normalize_reading(doc):
+    """Shape a stored reading the way the shared-memory ring returns it."""
+    reading = {}
+    for field in READING_FIELDS:
+        if field in doc:
+            value = doc[field]
+            if field in INT_READING_FIELDS:
+                value = int(value)
+            elif field != 'movimento':
+                value = float(value)
+            reading[field] = value
+    reading['timestamp'] = doc['timestamp']
+    return reading
+
+
+def process_alive(pid):
+    if not pid:
+        return False
+    if os.name != 'posix':
+        # os.kill would terminate the process on Windows, and named shared
+        # memory only outlives its last handle there anyway
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedReadings:
+    """Ring of recent readings in shared memory, guarded by a seqlock.
+
+    Layout: a header (seq, count, serial flag, capacity, instance id, owner
+    pid) followed by `capacity` fixed-size records. The single writer makes seq odd, writes
+    the record, bumps count and makes seq even again. Readers unpack straight
+    from the shared buffer without taking a lock and retry if seq was odd or
+    changed while they were reading.
+    """
+
+    HEADER = struct.Struct('<QQQQQQ')
+    RECORD = struct.Struct('<dQ' + 'd' * len(READING_FIELDS))
+    SEQ, COUNT, SERIAL, CAPACITY, INSTANCE, OWNER = (8 * i for i in range(6))
+
+    def __init__(self, shm):
+        self._shm = shm
+        self._buf = shm.buf
+        self.name = shm.name
+        self.size = self._word(self.CAPACITY)
+        self.instance = self._word(self.INSTANCE)
+
+    @classmethod
+    def create(cls, name=None, size=SHARED_WINDOW_SIZE):
+        name = name or SHARED_MEMORY_NAME
+        try:
+            shm = shared_memory.SharedMemory(
+                name=name, create=True, size=cls.HEADER.size + cls.RECORD.size * size)
+        except FileExistsError:
+            readings = cls.attach(name)
+            owner = readings._word(cls.OWNER)
+            if process_alive(owner):
+                readings.close()
+                raise RuntimeError(f"Shared memory '{name}' is owned by running process {owner}")
+            # Left behind by an owner that died: keep its readings and take over
+            if os.name == 'posix':
+                resource_tracker.register(readings._shm._name, 'shared_memory')
+            struct.pack_into('<Q', readings._buf, cls.OWNER, os.getpid())
+            return readings
+        instance = int.from_bytes(os.urandom(8), 'little')
+        cls.HEADER.pack_into(shm.buf, 0, 0, 0, 0, size, instance, os.getpid())
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name=None, track=False):
+        shm = shared_memory.SharedMemory(name=name or SHARED_MEMORY_NAME)
+        if not track and os.name == 'posix':
+            # Attaching registers the segment with this process's resource
+            # tracker, which would unlink it when the process exits
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm)
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+    def unlink(self):
+        self.close()
+        self._shm.unlink()
+
+    def _word(self, offset):
+        return struct.unpack_from('<Q', self._buf, offset)[0]
+
+    def _offset(self, index):
+        return self.HEADER.size + (index % self.size) * self.RECORD.size
+
+    def publish(self, reading):
+        # A writer that died mid-publish leaves seq odd; round up to even so
+        # readers aren't locked out for good
+        seq = (self._word(self.SEQ) + 1) & ~1
+        count = self._word(self.COUNT)
+        mask = 0
+        values = []
+        for bit, field in enumerate(READING_FIELDS):
+            value = reading.get(field)
+            if value is not None:
+                mask |= 1 << bit
+                if field == 'movimento':
+                    value = value == 'Rilevato'
+            values.append(float(value or 0))
+
+        struct.pack_into('<Q', self._buf, self.SEQ, seq + 1)
+        self.RECORD.pack_into(self._buf, self._offset(count),
+                              reading['timestamp'].timestamp(), mask, *values)
+        struct.pack_into('<Q', self._buf, self.COUNT, count + 1)
+        struct.pack_into('<Q', self._buf, self.SEQ, seq + 2)
+
+    def set_serial(self, connected):
+        # A single aligned word outside the seqlock; readers tolerate staleness
+        struct.pack_into('<Q', self._buf, self.SERIAL, int(connected))
+
+    def serial_connected(self):
+        return bool(self._word(self.SERIAL))
+
+    def count(self):
+        return self._word(self.COUNT)
+
+    def _decode(self, record):
+        timestamp, mask, *values = record
+        reading = {}
+        for bit, (field, value) in enumerate(zip(READING_FIELDS, values)):
+            if mask & (1 << bit):
+                if field == 'movimento':
+                    value = 'Rilevato' if value else 'Non rilevato'
+                elif field in INT_READING_FIELDS:
+                    value = int(value)
+                reading[field] = value
+        reading['timestamp'] = datetime.fromtimestamp(timestamp)
+        return reading
+
+    def recent(self, limit=1):
+        """Return up to `limit` readings, newest first, or None if the writer
+        kept the ring busy for SEQLOCK_MAX_RETRIES attempts."""
+        # One slot short of the ring, so a full read never overlaps the slot
+        # the writer fills next
+        limit = min(limit, self.size - 1)
+        for _ in range(SEQLOCK_MAX_RETRIES):
+            seq = self._word(self.SEQ)
+            if not seq & 1:
+                count = self._word(self.COUNT)
+                records = [self.RECORD.unpack_from(self._buf, self._offset(index))
+                           for index in range(count - 1, max(count - limit, 0) - 1, -1)]
+                # Only convert once the copy is known not to be torn
+                if self._word(self.SEQ) == seq:
+                    return [self._decode(record) for record in records]
+            time.sleep(0)
+        return None
+
+
+def get_shared_readings():
+    """Return the ingest owner's segment in process mode, following restarts."""
+    global shared_readings, _shared_checked_at
+
+    if _ingest_mode != 'process' or _shared_owner:
+        return shared_readings
+    now = time.monotonic()
+    if now - _shared_checked_at < SHARED_REATTACH_INTERVAL:
+        return shared_readings
+
+    with _shared_lock:
+        _shared_checked_at = now
+        try:
+            current = SharedReadings.attach()
+        except FileNotFoundError:
+            current = None
+        if current is not None and shared_readings is not None and current.instance == shared_readings.instance:
+            current.close()
+        else:
+            # The old mapping may still be in use by other request threads,
+            # so it is left for garbage collection instead of closed here
+            shared_readings = current
+    return shared_readings
+
+
+def set_serial_status(connected):
+    service_status['serial'] = connected
+    if shared_readings is not None:
+        shared_readings.set_serial(connected)
+
+
+def record_reading(reading):
+    service_status['last_reading'] = time.time()
+    if shared_readings is not None:
+        shared_readings.publish(reading)
+    query_cache.invalidate_open()
+
+
+def sync_shared_readings(readings):
+    # In process mode readings are stored by another process; pick them up
+    # from the shared counter before serving anything that may be open.
+    global _shared_count_seen
+
+    count = readings.count()
+    if count != _shared_count_seen:
+        _shared_count_seen = count
+        query_cache.invalidate_open()
 
 
 def arduino_reader():
@@ -46,13 +565,15 @@ def arduino_reader():
         try:
             with serial.Serial(ARDUINO_PORT, BAUD_RATE, timeout=1) as ser:
                 print(f"Connected to Arduino on port {ARDUINO_PORT}")
+                set_serial_status(True)
 
                 while True:
                     try:
                         line = ser.readline().decode('utf-8').strip()
                         if line:
                             data = json.loads(line)
-                            settings = settings_collection.find_one({}, {'_id': 0})
+                            # Until the settings document is seeded, keep every sensor enabled
+                            settings = settings_collection.find_one({}, {'_id': 0}) or default_settings
 
                             if settings:
                                 # Filter data based on enabled sensors
@@ -62,6 +583,7 @@ def arduino_reader():
                                 # Add data validation
                                 if validate_sensor_data(filtered_data):
                                     collection.insert_one(filtered_data)
+                                    record_reading(filtered_data)
                                     print(f"Saved data: {filtered_data}")
                                 else:
                                     print("Invalid sensor data received")
@@ -75,9 +597,11 @@ def arduino_reader():
 
         except serial.SerialException as e:
             print(f"Serial connection error: {e}")
+            set_serial_status(False)
             time.sleep(5)
         except Exception as e:
             print(f"Unexpected error in arduino_reader: {e}")
+            set_serial_status(False)
             time.sleep(5)
 
 
@@ -683,53 +1207,238 @@ HTML_TEMPLATE = '''
 '''
 
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
 
-@app.route('/api/data/current')
+@bp.route('/api/data/current')
 def get_current_data():
+    readings = get_shared_readings()
+    latest = readings.recent(1) if readings is not None else None
+    if latest is not None:
+        return jsonify(latest[0] if latest else {})
     try:
-        latest_data = collection.find_one(sort=[('timestamp', -1)])
-        if latest_data:
-            latest_data['_id'] = str(latest_data['_id'])
-            return jsonify(latest_data)
-        return jsonify({})
+        latest_data = query_cache.get_or_compute(('current',), fetch_current_data, is_open=True)
+        return jsonify(latest_data)
     except Exception as e:
         print(f"Error fetching current data: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
-@app.route('/api/settings', methods=['GET'])
+def fetch_current_data():
+    latest_data = current_collection.find_one(sort=[('timestamp', -1)])
+    return normalize_reading(latest_data) if latest_data else {}
+
+
+@bp.route('/api/data/history')
+def get_history_data():
+    try:
+        bucket = int(request.args.get('bucket', HISTORY_BUCKETS[0]))
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - HISTORY_DEFAULT_RANGE))
+        fields = request.args.get('fields')
+        fields = tuple(sorted(set(fields.split(',')))) if fields else tuple(sorted(HISTORY_FIELDS))
+        if not (math.isfinite(start) and math.isfinite(end)):
+            raise ValueError('non-finite time range')
+    except ValueError:
+        return jsonify({'error': 'Invalid query parameters'}), 400
+
+    if bucket not in HISTORY_BUCKETS or any(f not in HISTORY_FIELDS for f in fields):
+        return jsonify({'error': 'Invalid query parameters'}), 400
+
+    # Align the range to whole buckets so equivalent requests share cache entries
+    start = int(start) // bucket * bucket
+    end = -(-int(end) // bucket) * bucket
+    if end <= start or (end - start) // bucket > HISTORY_MAX_BUCKETS:
+        return jsonify({'error': 'Invalid time range'}), 400
+    try:
+        datetime.fromtimestamp(start)
+        datetime.fromtimestamp(end)
+    except (ValueError, OverflowError, OSError):
+        return jsonify({'error': 'Invalid time range'}), 400
+
+    closed_before = int(time.time() - HISTORY_CLOSE_GRACE) // bucket * bucket
+    closed_before = max(start, min(closed_before, end))
+    try:
+        buckets = []
+        if start < closed_before:
+            buckets += get_closed_buckets(fields, bucket, start, closed_before)
+        if closed_before < end:
+            readings = get_shared_readings()
+            if readings is not None:
+                sync_shared_readings(readings)
+            key = ('history-open', fields, bucket, closed_before, end)
+            buckets += query_cache.get_or_compute(
+                key, lambda: fetch_history_data(fields, bucket, closed_before, end, read_collection),
+                is_open=True)
+        return jsonify({'bucket': bucket, 'start': start, 'end': end, 'data': buckets})
+    except Exception as e:
+        print(f"Error fetching history data: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+def get_closed_buckets(fields, bucket, start, end):
+    keys = {b: ('history', fields, bucket, b) for b in range(start, end, bucket)}
+    cached = query_cache.get_many(list(keys.values()))
+    missing = [b for b, key in keys.items() if key not in cached]
+    if missing:
+        # One aggregate over the span of missing buckets, read from the primary
+        # since a lagging secondary would leave permanent gaps; empty buckets
+        # are cached as None so they aren't queried again
+        first, last = missing[0], missing[-1] + bucket
+        fetched = query_cache.get_or_compute(
+            ('history-fill', fields, bucket, first, last),
+            lambda: fetch_history_data(fields, bucket, first, last, current_collection), store=False)
+        by_start = {doc['timestamp']: doc for doc in fetched}
+        filled = {keys[b]: by_start.get(b) for b in range(first, last, bucket)}
+        query_cache.put_many(filled)
+        cached.update(filled)
+    return [cached[key] for key in keys.values() if cached[key] is not None]
+
+
+def fetch_history_data(fields, bucket, start, end, source):
+    # Timestamps are stored as naive local datetimes, so bucket in that space
+    start_dt = datetime.fromtimestamp(start)
+    end_dt = datetime.fromtimestamp(end)
+    group = {f: {'$avg': f'${f}'} for f in fields}
+    group['_id'] = {'$floor': {'$divide': [{'$subtract': ['$timestamp', start_dt]}, bucket * 1000]}}
+    group['count'] = {'$sum': 1}
+
+    pipeline = [
+        {'$match': {'timestamp': {'$gte': start_dt, '$lt': end_dt}}},
+        {'$group': group},
+        {'$sort': {'_id': 1}},
+    ]
+    buckets = []
+    for doc in source.aggregate(pipeline):
+        index = int(doc.pop('_id'))
+        doc['timestamp'] = start + index * bucket
+        buckets.append(doc)
+    return buckets
+
+
+@bp.route('/api/data/recent')
+def get_recent_data():
+    try:
+        limit = min(int(request.args.get('limit', 60)), SHARED_WINDOW_SIZE - 1)
+    except ValueError:
+        return jsonify({'error': 'Invalid query parameters'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid query parameters'}), 400
+
+    readings = get_shared_readings()
+    recent = readings.recent(limit) if readings is not None else None
+    if recent is not None:
+        return jsonify(recent)
+    try:
+        recent = current_collection.find(sort=[('timestamp', -1)], limit=limit)
+        return jsonify([normalize_reading(doc) for doc in recent])
+    except Exception as e:
+        print(f"Error fetching recent data: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@bp.route('/api/cache/stats')
+def get_cache_stats():
+    return jsonify(query_cache.stats())
+
+
+@bp.route('/api/settings', methods=['GET'])
 def get_settings():
     try:
-        settings = settings_collection.find_one({}, {'_id': 0})
+        settings = api_settings_collection.find_one({}, {'_id': 0})
         return jsonify(settings or default_settings)
     except Exception as e:
         print(f"Error fetching settings: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
-@app.route('/api/settings', methods=['POST'])
+@bp.route('/api/settings', methods=['POST'])
 def update_settings():
     try:
         new_settings = request.json
         if not all(isinstance(v, bool) for v in new_settings.values()):
             return jsonify({'error': 'Invalid settings format'}), 400
 
-        settings_collection.replace_one({}, new_settings, upsert=True)
+        api_settings_collection.replace_one({}, new_settings, upsert=True)
         return jsonify({"status": "success"})
     except Exception as e:
         print(f"Error updating settings: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
+def serial_connected():
+    readings = get_shared_readings()
+    if readings is not None:
+        return readings.serial_connected()
+    if _ingest_mode == 'process':
+        return False
+    return service_status['serial']
+
+
+@bp.route('/healthz')
+def healthz():
+    # Liveness only: answered from in-memory state, never touches MongoDB
+    last_reading = service_status['last_reading']
+    readings = get_shared_readings()
+    latest = readings.recent(1) if readings is not None else None
+    if latest is not None:
+        last_reading = latest[0]['timestamp'].timestamp() if latest else None
+    return jsonify({
+        'status': 'ok',
+        'serial': serial_connected(),
+        'mongo': service_status['mongo'],
+        'last_reading': last_reading,
+    })
+
+
+@bp.route('/readyz')
+def readyz():
+    ready = service_status['mongo'] and service_status['settings_seeded']
+    body = {
+        'ready': ready,
+        'mongo': service_status['mongo'],
+        'settings_seeded': service_status['settings_seeded'],
+        'serial': serial_connected(),
+        'last_mongo_check': service_status['last_mongo_check'],
+    }
+    return jsonify(body), 200 if ready else 503
+
+
+@bp.before_app_request
+def ensure_services():
+    # Fallback for servers that fork after create_app() without running the
+    # post_fork hook in gunicorn.conf.py
+    start_services(start_ingest=current_app.config['START_INGEST'],
+                   ingest_mode=current_app.config['INGEST_MODE'])
+
+
+def create_app(start_ingest=True, ingest_mode=None, start_background=True):
+    """Application factory; connections and workers start in the background.
+
+    Pass start_background=False when the app is loaded in a process that
+    will fork workers (gunicorn --preload); each worker then starts its own
+    services from the post_fork hook.
+    """
+    app = Flask(__name__)
+    CORS(app)
+    app.config['START_INGEST'] = start_ingest
+    app.config['INGEST_MODE'] = ingest_mode or INGEST_MODE
+    app.register_blueprint(bp)
+    if start_background:
+        start_services(start_ingest=start_ingest, ingest_mode=app.config['INGEST_MODE'])
+    return app
+
+
 def main():
+    if '--ingest' in sys.argv:
+        ingest_main()
+        return
     try:
-        arduino_thread = threading.Thread(target=arduino_reader, daemon=True)
-        arduino_thread.start()
-
+        if INGEST_MODE == 'process':
+            start_ingest_owner()
+        app = create_app()
         app.run(debug=False, host='0.0.0.0', port=5000, threaded=True)
     except Exception as e:
         print(f"Main application error: {e}")
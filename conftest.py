@@ -0,0 +1 @@
+# Lets the tests under tests/ import app.py from the repository root.
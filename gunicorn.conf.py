@@ -0,0 +1,9 @@
+# gunicorn reads this file from the working directory by default.
+# The app is built without background services so that a --preload master
+# never opens the serial port; every worker starts its own after the fork.
+wsgi_app = 'app:create_app(start_background=False)'
+
+
+def post_fork(server, worker):
+    import app
+    app.start_services()
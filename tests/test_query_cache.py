@@ -0,0 +1,159 @@
+import threading
+import time
+
+from app import QueryCache
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+def test_second_lookup_is_a_hit():
+    cache = QueryCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return 'value'
+
+    assert cache.get_or_compute('key', compute) == 'value'
+    assert cache.get_or_compute('key', compute) == 'value'
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_ratio']) == (1, 1, 0.5)
+
+
+def test_concurrent_misses_share_one_query():
+    cache = QueryCache()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        release.wait()
+        return 42
+
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute)))
+               for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: cache.stats()['coalesced'] == 9)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [42] * 10
+
+
+def test_waiters_get_leader_result_when_invalidated_mid_query():
+    cache = QueryCache()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        release.wait()
+        return 'open'
+
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute, is_open=True)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: cache.stats()['coalesced'] == 4)
+    cache.invalidate_open()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['open'] * 5
+    # Computed before the invalidation, so it must not be stored
+    assert cache.stats()['entries'] == 0
+
+
+def test_leader_error_propagates_to_waiters_and_is_not_cached():
+    cache = QueryCache()
+    release = threading.Event()
+    errors = []
+
+    def compute():
+        release.wait()
+        raise RuntimeError('query failed')
+
+    def call():
+        try:
+            cache.get_or_compute('key', compute)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: cache.stats()['coalesced'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3
+    assert len({id(e) for e in errors}) == 1
+    assert cache.get_or_compute('key', lambda: 'recovered') == 'recovered'
+
+
+def test_invalidate_open_keeps_closed_entries():
+    cache = QueryCache()
+    cache.get_or_compute('open', lambda: 1, is_open=True)
+    cache.put_many({'closed': 2})
+
+    cache.invalidate_open()
+
+    assert cache.get_many(['open', 'closed']) == {'closed': 2}
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_open_entry_reopened_as_closed_survives_invalidation():
+    cache = QueryCache()
+    cache.get_or_compute('key', lambda: 1, is_open=True)
+    cache.put_many({'key': 2})
+
+    cache.invalidate_open()
+
+    assert cache.get_many(['key']) == {'key': 2}
+
+
+def test_open_entries_expire_after_ttl():
+    cache = QueryCache(open_ttl=0)
+    cache.get_or_compute('key', lambda: 1, is_open=True)
+    time.sleep(0.01)
+
+    assert cache.get_or_compute('key', lambda: 2, is_open=True) == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryCache(max_entries=2)
+    cache.put_many({'a': 1, 'b': 2})
+    cache.get_many(['a'])
+    cache.put_many({'c': 3})
+
+    assert cache.get_many(['a', 'b', 'c']) == {'a': 1, 'c': 3}
+    assert cache.stats()['evictions'] == 1
+    # An evicted open key must not break a later invalidation
+    cache.get_or_compute('d', lambda: 4, is_open=True)
+    cache.put_many({'e': 5, 'f': 6})
+    cache.invalidate_open()
+
+
+def test_invalidate_open_does_not_scan_closed_entries():
+    cache = QueryCache(max_entries=20000)
+    cache.put_many({('bucket', i): i for i in range(19999)})
+    cache.get_or_compute('open', lambda: 1, is_open=True)
+
+    started = time.perf_counter()
+    for _ in range(100):
+        cache.invalidate_open()
+    assert (time.perf_counter() - started) / 100 < 0.001
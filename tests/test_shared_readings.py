@@ -0,0 +1,118 @@
+import os
+import struct
+import subprocess
+import sys
+import uuid
+from datetime import datetime
+from multiprocessing import resource_tracker
+
+import pytest
+
+import app
+from app import SharedReadings
+
+
+def unlink(readings):
+    # Owner and workers share one resource tracker in these tests, so an
+    # untracked attach may have dropped the owner's registration
+    if os.name == 'posix':
+        resource_tracker.register(readings._shm._name, 'shared_memory')
+    readings.unlink()
+
+
+@pytest.fixture
+def owner():
+    readings = SharedReadings.create(name=f'arduino_test_{uuid.uuid4().hex[:8]}', size=4)
+    yield readings
+    unlink(readings)
+
+
+def reading(temperatura, **extra):
+    return dict(temperatura=temperatura, timestamp=datetime.now(), **extra)
+
+
+def test_latest_reading_round_trips(owner):
+    owner.publish(reading(21.5, movimento='Rilevato', luce=512))
+
+    [latest] = owner.recent(1)
+
+    assert latest['temperatura'] == 21.5
+    assert latest['movimento'] == 'Rilevato'
+    assert latest['luce'] == 512 and isinstance(latest['luce'], int)
+    assert 'umidita' not in latest
+
+
+def test_recent_wraps_around_and_stays_one_short_of_the_ring(owner):
+    for value in range(10):
+        owner.publish(reading(float(value)))
+
+    recent = owner.recent(100)
+
+    assert [r['temperatura'] for r in recent] == [9.0, 8.0, 7.0]
+    assert owner.count() == 10
+
+
+def test_writer_crash_mid_publish_does_not_lock_readers_out(owner, monkeypatch):
+    monkeypatch.setattr(app, 'SEQLOCK_MAX_RETRIES', 10)
+    owner.publish(reading(20.0))
+    # Writer died after making seq odd
+    struct.pack_into('<Q', owner._buf, SharedReadings.SEQ, 3)
+
+    assert owner.recent(1) is None
+
+    writer = SharedReadings.attach(owner.name, track=True)
+    writer.publish(reading(21.0))
+    writer.close()
+
+    assert owner._word(SharedReadings.SEQ) % 2 == 0
+    assert owner.recent(1)[0]['temperatura'] == 21.0
+
+
+def test_second_owner_is_refused_while_first_is_alive(owner):
+    with pytest.raises(RuntimeError):
+        SharedReadings.create(name=owner.name)
+
+
+def test_segment_of_dead_owner_is_taken_over(owner):
+    owner.publish(reading(22.0))
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    struct.pack_into('<Q', owner._buf, SharedReadings.OWNER, dead.pid)
+
+    successor = SharedReadings.create(name=owner.name)
+
+    assert successor.instance == owner.instance
+    assert successor._word(SharedReadings.OWNER) == os.getpid()
+    assert successor.recent(1)[0]['temperatura'] == 22.0
+    successor.close()
+
+
+def test_worker_follows_owner_restart(monkeypatch):
+    name = f'arduino_test_{uuid.uuid4().hex[:8]}'
+    monkeypatch.setattr(app, 'SHARED_MEMORY_NAME', name)
+    monkeypatch.setattr(app, 'SHARED_REATTACH_INTERVAL', 0)
+    monkeypatch.setattr(app, '_ingest_mode', 'process')
+    monkeypatch.setattr(app, '_shared_owner', False)
+    monkeypatch.setattr(app, 'shared_readings', None)
+
+    assert app.get_shared_readings() is None
+
+    first = SharedReadings.create(size=4)
+    first.publish(reading(1.0))
+    assert app.get_shared_readings().recent(1)[0]['temperatura'] == 1.0
+    unlink(first)
+    assert app.get_shared_readings() is None
+
+    second = SharedReadings.create(size=4)
+    second.publish(reading(2.0))
+    attached = app.get_shared_readings()
+    assert attached.instance == second.instance != first.instance
+    assert attached.recent(1)[0]['temperatura'] == 2.0
+    unlink(second)
+
+
+def test_normalized_document_matches_shared_memory_shape(owner):
+    doc = reading(21, _id='abc', umidita=40, suono='300', movimento='Non rilevato', extra=True)
+    owner.publish(doc)
+
+    assert app.normalize_reading(doc) == {**owner.recent(1)[0], 'timestamp': doc['timestamp']}